@@ -4,42 +4,44 @@ import datetime
 import logging
 import os
 import re
-import signal
-import subprocess
-import sys
+from pathlib import Path
+from textwrap import indent
 
 import vrnetlab
 
-CLOUD_INIT_CONFIG_FILE = "/config/cloud-init.yaml"
-ZCLOUD_XML_FILE = "/config/zcloud.xml"
+CONFIG_DIR = "/config"
+CLOUD_INIT_CONFIG_FILE = f"{CONFIG_DIR}/cloud-init.yaml"
+ZCLOUD_XML_FILE = f"{CONFIG_DIR}/zcloud.xml"
 
+# RAM (in MB) per component type
+_RAM_MAP = {
+    "manager": 16384,
+    "controller": 4096,
+    "validator": 2048,
+}
 
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
+# Map component types to their personalities and template names
+_COMPONENT_MAP = {
+    "manager": {"personality": "vmanage", "template": "manager-zcloud.xml.j2"},
+    "controller": {"personality": "vsmart", "template": "controller-zcloud.xml.j2"},
+    "validator": {"personality": "vbond", "template": "validator-zcloud.xml.j2"}
+}
 
+# raw template contents keyed by path, and rendered output keyed by
+# template name plus the values substituted into it
+_TEMPLATE_CACHE: dict[str, str] = {}
+_RENDER_CACHE: dict[tuple, str] = {}
+# template placeholders, e.g. "{{ hostname }}"
+_VAR_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
 
-def handle_SIGTERM(signal, frame):
-    sys.exit(0)
-
-
-signal.signal(signal.SIGINT, handle_SIGTERM)
-signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
-
-TRACE_LEVEL_NUM = 9
-logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
-
-
-def trace(self, message, *args, **kws):
-    # Yes, logger takes its '*args' as 'args'.
-    if self.isEnabledFor(TRACE_LEVEL_NUM):
-        self._log(TRACE_LEVEL_NUM, message, args, **kws)
-
-
-logging.Logger.trace = trace
+vrnetlab.install_signal_handlers()
+vrnetlab.install_trace_logger()
 
 
 class Sdwan_component_vm(vrnetlab.VM):
+    # user config file contents keyed by path, stored with the mtime they were read at
+    _config_cache: dict[str, tuple[float, str]] = {}
+
     def __init__(
         self,
         hostname,
@@ -49,26 +51,28 @@ class Sdwan_component_vm(vrnetlab.VM):
         conn_mode,
         component_type,
     ):
-        for e in os.listdir("/"):
-            if re.search(".qcow2$", e):
-                disk_image = "/" + e
-                # Detect component type from filename if not specified
-                if not component_type:
-                    e_lower = e.lower()
-                    if "manage" in e_lower:
-                        component_type = "manager"
-                    elif "smart" in e_lower:
-                        component_type = "controller"
-                    elif "bond" in e_lower:
-                        component_type = "validator"
+        with os.scandir("/") as it:
+            for entry in it:
+                name = entry.name
+                # skip the overlay and additional disks created next to the base image
+                if name.startswith("disk_") or "-overlay" in name:
+                    continue
+                if entry.is_file() and name.endswith(".qcow2"):
+                    disk_image = "/" + name
+                    # Detect component type from filename if not specified
+                    if not component_type:
+                        name_lower = name.lower()
+                        if "manage" in name_lower:
+                            component_type = "manager"
+                        elif "smart" in name_lower:
+                            component_type = "controller"
+                        elif "bond" in name_lower:
+                            component_type = "validator"
+                    # only a single image is expected
+                    break
 
         # Set RAM based on component type
-        ram_map = {
-            "manager": 16384,
-            "controller": 4096,
-            "validator": 2048,
-        }
-        ram = ram_map.get(component_type, 4096)
+        ram = _RAM_MAP.get(component_type, 4096)
 
         super(Sdwan_component_vm, self).__init__(
             username, password, disk_image=disk_image, ram=ram
@@ -76,6 +80,7 @@ class Sdwan_component_vm(vrnetlab.VM):
 
         self.conn_mode = conn_mode
         self.component_type = component_type
+        self._prompt_re = [re.compile(b"System Ready")]
         self.nic_type = "virtio-net-pci"
 
         # Set hostname to sdwan-<component-type> if not specified
@@ -101,24 +106,41 @@ class Sdwan_component_vm(vrnetlab.VM):
     def load_template(self, template_name):
         """Load and render a template file"""
         template_path = f"/templates/{template_name}"
-        with open(template_path, "r") as f:
-            template = f.read()
+        template = _TEMPLATE_CACHE.get(template_path)
+        if template is None:
+            template = Path(template_path).read_text()
+            _TEMPLATE_CACHE[template_path] = template
 
         # Extract IP and prefix from CIDR notation (e.g., "10.0.0.15/24")
         ip_with_prefix = self.mgmt_address_ipv4
+        cache_key = (
+            template_name,
+            self.hostname,
+            self.username,
+            self.password,
+            ip_with_prefix,
+            self.mgmt_gw_ipv4,
+        )
+        if cache_key in _RENDER_CACHE:
+            return _RENDER_CACHE[cache_key]
+
+        ip, prefix = ip_with_prefix.split('/', 1)
         variables = {
             "hostname": self.hostname,
             "username": self.username,
             "password": self.password,
-            "mgmt_ip": ip_with_prefix.split('/')[0],
-            "mgmt_prefix": ip_with_prefix.split('/')[1],
+            "mgmt_ip": ip,
+            "mgmt_prefix": prefix,
             "mgmt_gw": self.mgmt_gw_ipv4
         }
 
-        for key, value in variables.items():
-            template = template.replace(f"{{{{ {key} }}}}", str(value))
+        # substitute all placeholders in a single pass, leaving unknown ones untouched
+        rendered = _VAR_RE.sub(
+            lambda m: str(variables.get(m.group(1), m.group(0))), template
+        )
 
-        return template
+        _RENDER_CACHE[cache_key] = rendered
+        return rendered
 
     def gen_cloud_config(self, custom_zcloud=None):
         """Generate cloud-init configuration based on component type
@@ -126,14 +148,7 @@ class Sdwan_component_vm(vrnetlab.VM):
         Args:
             custom_zcloud: Optional custom zcloud.xml content. If None, uses template.
         """
-        # Map component types to their personalities and template names
-        component_map = {
-            "manager": {"personality": "vmanage", "template": "manager-zcloud.xml.j2"},
-            "controller": {"personality": "vsmart", "template": "controller-zcloud.xml.j2"},
-            "validator": {"personality": "vbond", "template": "validator-zcloud.xml.j2"}
-        }
-
-        config = component_map.get(self.component_type, component_map["manager"])
+        config = _COMPONENT_MAP.get(self.component_type, _COMPONENT_MAP["manager"])
 
         # Use custom zcloud if provided, otherwise load from template
         if custom_zcloud:
@@ -142,11 +157,11 @@ class Sdwan_component_vm(vrnetlab.VM):
             zcloud_xml = self.load_template(config["template"])
 
         # Build cloud-init config
-        cloud_config = "#cloud-config\n"
+        parts = ["#cloud-config\n"]
 
         # Add disk setup only for manager
         if self.component_type == "manager":
-            cloud_config += """disk_setup:
+            parts.append("""disk_setup:
   /dev/vda:
     table_type: mbr
     layout: false
@@ -159,54 +174,74 @@ fs_setup:
   overwrite: false
 mounts:
 - [ /dev/vda, /opt/data ]
-"""
+""")
 
-        cloud_config += "write_files:\n"
+        parts.append("write_files:\n")
 
         # Add persona file only for manager
         if self.component_type == "manager":
-            cloud_config += """- path: /opt/web-app/etc/persona
+            parts.append("""- path: /opt/web-app/etc/persona
   owner: vmanage:vmanage-admin
   permissions: '0644'
   content: '{"persona":"COMPUTE_AND_DATA"}'
-"""
+""")
 
         # Add common files
-        cloud_config += f"""- path: /etc/default/personality
+        parts.append(f"""- path: /etc/default/personality
   content: "{config['personality']}\\n"
 - path: /etc/default/inited
   content: "1\\n"
 - path: /usr/share/viptela/symantec-root-ca.crt
 - path: /etc/confd/init/zcloud.xml
   content: |
-{chr(10).join('    ' + line for line in zcloud_xml.split(chr(10)))}
-"""
+{indent(zcloud_xml, "    ", lambda _: True)}
+""")
 
-        return cloud_config
+        return "".join(parts)
 
     def create_boot_image(self):
         """Creates a cloud-init iso image with a bootstrap configuration"""
         cloud_config = self._load_user_config() or self._generate_default_config()
 
-        with open("/bootstrap_config.yaml", "w") as cfg_file:
-            cfg_file.write(cloud_config)
+        Path("/bootstrap_config.yaml").write_text(cloud_config)
+
+        cloud_localds_args = ["cloud-localds", "-v", "/" + self.image_name, "/bootstrap_config.yaml"]
 
-        subprocess.Popen(["cloud-localds", "-v", "/" + self.image_name, "/bootstrap_config.yaml"])
+        # the iso must exist before qemu is started
+        vrnetlab.run_and_wait(cloud_localds_args)
 
     def _load_user_config(self):
         """Load user-provided configuration if present"""
-        if os.path.exists(CLOUD_INIT_CONFIG_FILE):
+        # list the config dir once instead of probing each file separately
+        try:
+            with os.scandir(CONFIG_DIR) as it:
+                entries = {e.name for e in it}
+        except OSError:
+            # missing, unreadable or not a directory
+            return None
+
+        if os.path.basename(CLOUD_INIT_CONFIG_FILE) in entries:
             self.logger.info("Found full cloud-init configuration at %s", CLOUD_INIT_CONFIG_FILE)
-            with open(CLOUD_INIT_CONFIG_FILE, "r") as f:
-                return f.read()
+            return self._read_cached(CLOUD_INIT_CONFIG_FILE)
 
-        if os.path.exists(ZCLOUD_XML_FILE):
+        if os.path.basename(ZCLOUD_XML_FILE) in entries:
             self.logger.info("Found zcloud.xml configuration at %s", ZCLOUD_XML_FILE)
-            with open(ZCLOUD_XML_FILE, "r") as f:
-                return self.gen_cloud_config(custom_zcloud=f.read())
+            return self.gen_cloud_config(custom_zcloud=self._read_cached(ZCLOUD_XML_FILE))
 
         return None
 
+    @classmethod
+    def _read_cached(cls, path):
+        """Read a file, reusing the cached contents if it has not changed"""
+        mtime = os.stat(path).st_mtime
+        cached = cls._config_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        content = Path(path).read_text()
+        cls._config_cache[path] = (mtime, content)
+        return content
+
     def _generate_default_config(self):
         """Generate default cloud-init configuration"""
         self.logger.info("Generating default configuration for %s", self.component_type)
@@ -215,14 +250,14 @@ mounts:
     def bootstrap_spin(self):
         """This function should be called periodically to do work."""
 
-        if self.spins > 6000:
+        if self.spins > 2000:
             # too many spins with no result ->  give up
             self.logger.debug("Too many spins -> give up")
             self.stop()
             self.start()
             return
 
-        (ridx, match, res) = self.tn.expect([b"System Ready"], 1)
+        (ridx, match, res) = self.tn.expect(self._prompt_re, 5)
         if match:  # got a match!
             if ridx == 0:  # System Ready
                 self.logger.debug("System Ready detected")
@@ -249,12 +284,18 @@ mounts:
 
     def gen_nics(self):
         """Generate QEMU args for data plane NICs as tap interfaces"""
-        res = []
         # Generate data plane NICs (p01-pXX) as tap interfaces
         # Management NIC (p00) is handled by parent class
+        # four args per NIC, so size the list up front
+        res = [None] * (4 * (self.num_nics - 1))
+        j = 0
         for i in range(1, self.num_nics):
-            res.extend(["-device", f"{self.nic_type},netdev=p{i:02d},mac={vrnetlab.gen_mac(i)}"])
-            res.extend(["-netdev", f"tap,ifname=p{i:02d},id=p{i:02d},script=no,downscript=no"])
+            nic_id = f"p{i:02d}"
+            res[j] = "-device"
+            res[j + 1] = f"{self.nic_type},netdev={nic_id},mac={vrnetlab.gen_mac(i)}"
+            res[j + 2] = "-netdev"
+            res[j + 3] = f"tap,ifname={nic_id},id={nic_id},script=no,downscript=no"
+            j += 4
         return res
 
     def add_disk(self, disk_size, driveif="ide"):
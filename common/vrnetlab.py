@@ -8,6 +8,7 @@ import math
 import os
 import random
 import re
+import signal
 import subprocess
 import sys
 import telnetlib
@@ -23,6 +24,8 @@ MAX_RETRIES = 60
 
 DEFAULT_SCRAPLI_TIMEOUT = 900
 
+TRACE_LEVEL_NUM = 9
+
 # set fancy logging colours
 logging.addLevelName(
     logging.INFO, f"\x1b[1;32m\t{logging.getLevelName(logging.INFO)}\x1b[0m"
@@ -80,6 +83,53 @@ def boot_delay():
         time.sleep(int(delay))
 
 
+def handle_SIGCHLD(signal, frame):
+    # several children may exit before the handler runs, reap all of them
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            break
+
+
+def handle_SIGTERM(signal, frame):
+    sys.exit(0)
+
+
+def run_and_wait(cmd):
+    """Run a command to completion, raising CalledProcessError on failure
+
+    SIGCHLD is blocked meanwhile so handle_SIGCHLD cannot reap the child
+    before subprocess does, which would hide its exit status.
+    """
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGCHLD})
+    try:
+        return subprocess.run(cmd, check=True)
+    finally:
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+
+
+def install_signal_handlers():
+    """Exit cleanly on SIGINT/SIGTERM and reap exited child processes"""
+    signal.signal(signal.SIGINT, handle_SIGTERM)
+    signal.signal(signal.SIGTERM, handle_SIGTERM)
+    signal.signal(signal.SIGCHLD, handle_SIGCHLD)
+
+
+def trace(self, message, *args, **kws):
+    # Yes, logger takes its '*args' as 'args'.
+    if self.isEnabledFor(TRACE_LEVEL_NUM):
+        self._log(TRACE_LEVEL_NUM, message, args, **kws)
+
+
+def install_trace_logger():
+    """Register the TRACE log level and add Logger.trace()"""
+    logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
+    logging.Logger.trace = trace
+
+
 class VM:
     def __str__(self):
         return self.__class__.__name__
@@ -4,40 +4,43 @@ import datetime
 import logging
 import os
 import re
-import signal
 import subprocess
-import sys
+from pathlib import Path
 
 import yaml
 import vrnetlab
 
+# prefer the libyaml C bindings when available
+try:
+    from yaml import CSafeDumper as _Dumper
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeDumper as _Dumper
+    from yaml import SafeLoader as _Loader
+
+# the network config is static, serialize it once at import
+_NETWORK_YAML = yaml.dump(
+    {
+        'version': 2,
+        'ethernets': {
+            'vtnet0': {
+                'addresses': ['10.0.0.15/24'],
+                'gateway4': '10.0.0.2'
+            }
+        }
+    },
+    Dumper=_Dumper,
+    default_flow_style=False,
+)
+
 CLOUD_INIT_CONFIG_FILE = "/config/cloud-init.yaml"
 BACKUP_FILE = "/config/backup.tar.gz"
+# cloud-localds inputs are only read once, keep them on tmpfs
+BOOTSTRAP_CONFIG_FILE = "/dev/shm/bootstrap_config.yaml"
+NETWORK_CONFIG_FILE = "/dev/shm/network_config.yaml"
 
-
-def handle_SIGCHLD(signal, frame):
-    os.waitpid(-1, os.WNOHANG)
-
-
-def handle_SIGTERM(signal, frame):
-    sys.exit(0)
-
-
-signal.signal(signal.SIGINT, handle_SIGTERM)
-signal.signal(signal.SIGTERM, handle_SIGTERM)
-signal.signal(signal.SIGCHLD, handle_SIGCHLD)
-
-TRACE_LEVEL_NUM = 9
-logging.addLevelName(TRACE_LEVEL_NUM, "TRACE")
-
-
-def trace(self, message, *args, **kws):
-    # Yes, logger takes its '*args' as 'args'.
-    if self.isEnabledFor(TRACE_LEVEL_NUM):
-        self._log(TRACE_LEVEL_NUM, message, args, **kws)
-
-
-logging.Logger.trace = trace
+vrnetlab.install_signal_handlers()
+vrnetlab.install_trace_logger()
 
 
 class FreeBSD_vm(vrnetlab.VM):
@@ -49,9 +52,15 @@ class FreeBSD_vm(vrnetlab.VM):
         nics,
         conn_mode,
     ):
-        for e in os.listdir("/"):
-            if re.search(".qcow2$", e):
-                disk_image = "/" + e
+        with os.scandir("/") as it:
+            for entry in it:
+                name = entry.name
+                # skip the overlay disk created next to the base image
+                if "-overlay" in name:
+                    continue
+                if entry.is_file() and name.endswith(".qcow2"):
+                    disk_image = "/" + name
+                    break
 
         super(FreeBSD_vm, self).__init__(
             username, password, disk_image=disk_image, ram=512
@@ -61,6 +70,7 @@ class FreeBSD_vm(vrnetlab.VM):
         self.hostname = hostname
         self.conn_mode = conn_mode
         self.nic_type = "virtio-net-pci"
+        self._prompt_re = [re.compile(b"login: ")]
 
         self.image_name = "cloud_init.iso"
         self.create_boot_image()
@@ -68,18 +78,20 @@ class FreeBSD_vm(vrnetlab.VM):
         self.qemu_args.extend(["-cdrom", "/" + self.image_name])
 
     def _merge_cloud_init_config(self, dest, src):
-        """Cleanly merge two dictionaries, recursively"""
-        result = dest.copy()
-        # Update destination with source to avoid losing the default configuration
-        result.update(src)
-
-        # Merge all lists recursively, this cannot be done with the update() method
-        for key in src:
-            if key in dest:
-                if isinstance(dest[key], dict) and isinstance(src[key], dict):
-                    result[key] = self._merge_cloud_init_config(dest[key], src[key])
-                elif isinstance(dest[key], list) and isinstance(src[key], list):
-                    result[key] = dest[key] + src[key]
+        """Cleanly merge two dictionaries, nested dicts are merged and lists concatenated"""
+        result = dict(dest)
+        stack = [(result, src)]
+        while stack:
+            d, s = stack.pop()
+            for key, value in s.items():
+                if key in d and isinstance(d[key], dict) and isinstance(value, dict):
+                    # copy the nested dict so the caller's dest is never modified
+                    d[key] = dict(d[key])
+                    stack.append((d[key], value))
+                elif key in d and isinstance(d[key], list) and isinstance(value, list):
+                    d[key] = d[key] + value
+                else:
+                    d[key] = value
         return result
 
     def create_boot_image(self):
@@ -107,23 +119,12 @@ class FreeBSD_vm(vrnetlab.VM):
             ]
         }
 
-        network_data = {
-            'version': 2,
-            'ethernets': {
-                'vtnet0': {
-                    'addresses': ['10.0.0.15/24'],
-                    'gateway4': '10.0.0.2'
-                }
-            }
-        }
-
         # Merge custom user cloud-init config if the file exists
         if os.path.exists(CLOUD_INIT_CONFIG_FILE):
             self.logger.debug(f"Found custom config at '{CLOUD_INIT_CONFIG_FILE}'")
             try:
-                with open(CLOUD_INIT_CONFIG_FILE, 'r') as f:
-                    custom_data = yaml.safe_load(f)
-                    bootstrap_data = self._merge_cloud_init_config(bootstrap_data, custom_data)
+                custom_data = yaml.load(Path(CLOUD_INIT_CONFIG_FILE).read_text(), Loader=_Loader)
+                bootstrap_data = self._merge_cloud_init_config(bootstrap_data, custom_data)
             except yaml.YAMLError as e:
                 self.logger.error(f"Could not parse custom config file: {e}")
             except IOError as e:
@@ -131,22 +132,23 @@ class FreeBSD_vm(vrnetlab.VM):
         else:
             self.logger.debug(f"No custom config file found at '{CLOUD_INIT_CONFIG_FILE}'. Using defaults.")
 
-        with open("/bootstrap_config.yaml", "w") as cfg_file:
-            cfg_file.write("#cloud-config\n")
-            yaml.dump(bootstrap_data, cfg_file, default_flow_style=False)
+        Path(BOOTSTRAP_CONFIG_FILE).write_text(
+            "#cloud-config\n"
+            + yaml.dump(bootstrap_data, Dumper=_Dumper, default_flow_style=False)
+        )
 
-        with open("/network_config.yaml", "w") as net_cfg_file:
-            yaml.dump(network_data, net_cfg_file, default_flow_style=False)
+        Path(NETWORK_CONFIG_FILE).write_text(_NETWORK_YAML)
 
         cloud_localds_args = [
             "cloud-localds",
             "-v",
-            "--network-config=/network_config.yaml",
+            f"--network-config={NETWORK_CONFIG_FILE}",
             "/" + self.image_name,
-            "/bootstrap_config.yaml",
+            BOOTSTRAP_CONFIG_FILE,
         ]
 
-        subprocess.Popen(cloud_localds_args)
+        # the iso must exist before qemu is started
+        vrnetlab.run_and_wait(cloud_localds_args)
 
     def restore_backup(self):
         """Restore saved backup if there is one"""
@@ -166,13 +168,13 @@ class FreeBSD_vm(vrnetlab.VM):
     def bootstrap_spin(self):
         """This function should be called periodically to do work."""
 
-        if self.spins > 600:
+        if self.spins > 200:
             # too many spins with no result ->  give up
             self.stop()
             self.start()
             return
 
-        (ridx, match, res) = self.tn.expect([b"login: "], 1)
+        (ridx, match, res) = self.tn.expect(self._prompt_re, 5)
         if match:  # got a match!
             if ridx == 0:  # login
 